@@ -2,6 +2,8 @@
 
 from sys import argv, exit
 import argparse
+import hashlib
+import os
 import warnings
 
 from matplotlib import rcParams
@@ -9,6 +11,7 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 
 """
 Generates a pretty areaplot from a collapsed feature table.
@@ -27,6 +30,11 @@ rcParams['ps.fonttype'] = 42
 # Sets up the order of colors to be used in joint plots.
 colors_order = ['Reds', 'Blues', 'Greens', 'Purples', "Oranges", 'Greys']
 
+# Sets up the number of plotted points (taxa x samples) above which the areas
+# are rasterized. Below this, the vector areas are smaller than the 300 dpi
+# raster.
+raster_points = 50000
+
 over9 = {'Paired', 'Paired_r', 'Set3', 'Set3_r'}
 over8 = over9 | {'Set1', "Pastel1"}
 
@@ -86,12 +94,41 @@ def extract_label_array(table, tax_col, tax_delim='|'):
     Returns
     -------
     DataFrame
+        The taxonomic strings parsed into n levels, with each level stored
+        as a categorical
+    """
+    split_ = table[tax_col].str.split(tax_delim, expand=True, regex=False)
+
+    return split_.apply(lambda s: s.str.strip().astype('category'))
+
+
+def level_filter(taxa, level, consider_nan=True):
+    """
+    Finds the rows of a parsed taxonomy which describe a taxonomic level
+
+    Parameters
+    ----------
+    taxa: DataFrame
         The taxonomic strings parsed into n levels
+    level: int
+        The taxonomic level of interest
+    consider_nan: bool, optional
+        Whether only rows ending at `level` should be kept, rather than all
+        rows with information at `level`. See `level_taxonomy`.
+
+    Returns
+    -------
+    Series
+        A boolean mask of the rows in `taxa` at `level`
     """
-    def f_(x):
-        return pd.Series([y.strip() for y in x.split(tax_delim)])
-    
-    return table[tax_col].apply(f_)
+    if level not in taxa.columns:
+        return pd.Series(False, index=taxa.index)
+
+    leveler = taxa[level].notna()
+    if consider_nan and ((level + 1) in taxa.columns):
+        leveler &= taxa[level + 1].isna()
+
+    return leveler
 
 
 def level_taxonomy(table, taxa, samples, level, consider_nan=True):
@@ -114,27 +151,149 @@ def level_taxonomy(table, taxa, samples, level, consider_nan=True):
         considering `nan` will filter the samples to retain only the levels 
         of interest. This is recommended for kraken/bracken tables, but not 
         applicable for some 16s sequences
+
+    Returns
+    -------
+    DataFrame
+        The relative abundance of each taxon at `level` in each sample. The
+        values are stored as float32; with roughly seven significant digits
+        this is ample for plotting, even for taxa below 1e-3 abundance, and 
+        halves the memory moved by the sums that follow.
     """
     level = level.max()
+    leveler = level_filter(taxa, level, consider_nan)
+
+    cols = list(np.arange(level + 1))
+    labels_ = taxa.loc[leveler, cols]
+
+    # Converts the filtered counts to per-sample relative abundance, working
+    # on a single numpy block rather than on repeated DataFrame selections.
+    # The block is kept in column-major order so each sample is contiguous
+    # for the reductions over taxa and can be wrapped by pandas without a copy
+    sub_ = table.loc[leveler, samples]
+    arr_ = np.asfortranarray(sub_.to_numpy(dtype=np.float32, copy=True))
+    # Missing counts are skipped in the sample totals, as pandas does, and
+    # samples without counts at this level are left as NaN without warning
+    with np.errstate(invalid='ignore', divide='ignore'):
+        arr_ /= np.nansum(arr_, axis=0, keepdims=True)
+    index_ = pd.MultiIndex.from_frame(labels_)
+
+    if not labels_.duplicated().any():
+        return pd.DataFrame(arr_, index=index_, columns=samples, copy=False)
+
+    # Sums the duplicated taxa by sorting the rows on their factorized labels
+    # and reducing each contiguous segment, which avoids the hash-based
+    # groupby engine. Missing values count as zero, as in a groupby sum.
+    codes_, uniques_ = index_.factorize(sort=True)
+    order_ = np.argsort(codes_, kind='stable')
+    starts_ = np.flatnonzero(np.diff(codes_[order_], prepend=-1))
+    sorted_ = np.nan_to_num(arr_[order_], nan=0, copy=False)
+    summed_ = np.add.reduceat(sorted_, starts_, axis=0)
+    summed_ = np.asfortranarray(summed_)
+    uniques_.names = cols
+
+    return pd.DataFrame(summed_, index=uniques_, columns=samples, copy=False)
+
+
+def level_taxonomy_polars(table, samples, level, tax_col, tax_delim='|', 
+    consider_nan=True):
+    """
+    Gets the taxonomy collapsed to the desired level using polars
+
+    This parses, filters, normalizes and sums the table in polars and only
+    converts the collapsed table to pandas, giving the same result as 
+    `extract_label_array` followed by `level_taxonomy`.
+
+    Parameters
+    ----------
+    table : polars.DataFrame
+        A table with observation on the rows (biom-style table) with 
+        `tax_col` and `samples` in its columns.
+    samples : list
+        The columns from `table` to be included in the analysis
+    level: int
+        The level to which the taxonomy should be summarized 
+    tax_col : str
+        The column in `table` containing the taxonomy information
+    tax_delim: str, optional
+        The delimiter between taxonomic groups
+    consider_nan: bool, optional
+        Whether only rows ending at `level` should be kept. See 
+        `level_taxonomy`.
+
+    Returns
+    -------
+    DataFrame
+        The relative abundance of each taxon at `level` in each sample, as 
+        float32.
+    """
+    # Polars is only needed for this engine, so it is imported here
+    import polars as pl
+
+    cols = [str(l_) for l_ in range(level + 1)]
+    taxa_ = pl.col(tax_col).str.split(tax_delim)
+
     if consider_nan:
-        leveler = (taxa[level].notna() & taxa[(level + 1)].isna())
+        leveler = taxa_.list.len() == (level + 1)
     else:
-        leveler = (taxa[level].notna())
-            
-    cols = list(np.arange(level + 1))
-    
-    # Combines the filtered tables
-    level_ = pd.concat(
-        axis=1, 
-        objs=[taxa.loc[leveler, cols],
-              (table.loc[leveler, samples] / table.loc[leveler, samples].sum(axis=0))],
-    #     # sort=False
+        leveler = taxa_.list.len() > level
+
+    level_ = table.filter(leveler).select(
+        [taxa_.list.get(i).str.strip_chars().alias(c) 
+         for i, c in enumerate(cols)] +
+        [pl.col(samples).cast(pl.Float32)]
     )
-    level_.reset_index()
-    if taxa.loc[leveler, cols].duplicated().any():
-        return level_.groupby(cols).sum()
+    level_ = level_.with_columns(pl.col(samples) / pl.col(samples).sum())
+
+    # As with pandas, only duplicated taxa are summed (treating missing 
+    # values as zero) and then returned in sorted order; otherwise the rows
+    # and any missing values are kept as they are
+    if level_.select(cols).is_duplicated().any():
+        collapsed = level_.group_by(cols).agg(pl.col(samples).sum()).sort(cols)
     else:
-        return level_.set_index(cols)
+        collapsed = level_
+
+    collapsed = collapsed.to_pandas().set_index(cols)
+    collapsed.index.names = list(range(level + 1))
+
+    return collapsed
+
+
+def stack_limits(top_taxa):
+    """
+    Gets the upper and lower limits for stacking the taxa in order
+
+    Parameters
+    ----------
+    top_taxa: DataFrame
+        The relative abundance of the taxa to be stacked, with the taxa
+        as rows (in stacking order) and the samples as columns
+
+    Returns
+    -------
+    DataFrame, DataFrame
+        The upper and lower limits of each taxon in the stack. The lower
+        limit is the upper limit of the previous taxon, so the cumulative
+        sum is only calculated once. Missing values are skipped in the 
+        cumulative sum.
+    """
+    values_ = np.asfortranarray(top_taxa.to_numpy())
+    upper_ = np.nancumsum(values_, axis=0)
+    lower_ = np.zeros_like(upper_)
+    lower_[1:] = upper_[:-1]
+
+    # As with DataFrame.cumsum, a missing value is skipped in the running
+    # total but stays missing for its own taxon
+    missing_ = np.isnan(values_)
+    upper_[missing_] = np.nan
+    lower_[missing_] = np.nan
+
+    upper_ = pd.DataFrame(upper_, index=top_taxa.index,
+                          columns=top_taxa.columns, copy=False)
+    lower_ = pd.DataFrame(lower_, index=top_taxa.index,
+                          columns=top_taxa.columns, copy=False)
+
+    return upper_, lower_
 
 
 def profile_one_level(collapsed, level, threshold=0.01, count=8):
@@ -156,30 +315,26 @@ def profile_one_level(collapsed, level, threshold=0.01, count=8):
     DataFame
         A table of the top taxa for the data of interest
     """
-    collapsed['mean'] = collapsed.mean(axis=1)
-    collapsed.sort_values(['mean'], ascending=False, inplace=True)
-    collapsed['count'] = 1
-    collapsed['count'] = collapsed['count'].cumsum()
-
-    thresh_ = (collapsed['mean'] > threshold) & (collapsed['count'] <= count)
-    top_taxa = collapsed.loc[thresh_].copy()
-    top_taxa.drop(columns=['mean', 'count'], inplace=True)
+    # Only the `count` most abundant taxa can be shown, so they are selected
+    # with a partial sort and only those few rows are then ordered. Taxa
+    # without counts in any sample have no mean, which is not worth a
+    # warning.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        means_ = np.nanmean(collapsed.to_numpy(), axis=1)
+    k_ = min(int(count), means_.size)
+    top_ = np.argpartition(-means_, k_ - 1)[:k_]
+    top_ = top_[np.argsort(-means_[top_], kind='stable')]
+    top_ = top_[means_[top_] > threshold]
+    top_taxa = collapsed.iloc[top_].copy()
     for l_ in np.arange(level):
         top_taxa.index = top_taxa.index.droplevel(l_)
 
-    first_ = top_taxa.index[0]
-    
-    top_taxa.sort_values(
-        [first_],
-        ascending=False,
-        axis='columns',
-        inplace=True,
-    )
+    # Orders the samples by the abundance of the most abundant taxon
+    order_ = np.argsort(-top_taxa.iloc[0].to_numpy(), kind='stable')
+    top_taxa = top_taxa.iloc[:, order_]
 
-    upper_ = top_taxa.cumsum()
-    lower_ = top_taxa.cumsum() - top_taxa
-
-    return upper_, lower_
+    return stack_limits(top_taxa)
 
 
 def profile_joint_levels(collapsed, lo_, hi_, samples, lo_thresh=0.01, 
@@ -208,16 +363,29 @@ def profile_joint_levels(collapsed, lo_, hi_, samples, lo_thresh=0.01,
     DataFame
         A table of the top taxa for the data of interest
     """
-    collapsed['mean_hi'] = collapsed.mean(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        collapsed['mean_hi'] = np.nanmean(collapsed.to_numpy(), axis=1)
     collapsed.reset_index(inplace=True)
-    mean_lo_rep = collapsed.groupby(lo_)['mean_hi'].sum().to_dict()
-    collapsed['mean_lo'] = collapsed[lo_].replace(mean_lo_rep)
-    collapsed.sort_values(['mean_lo', 'mean_hi'], ascending=False, inplace=True)
-
-    collapsed['count_lo'] = ~collapsed[lo_].duplicated(keep='first') * 1.
-    collapsed['count_lo'] = collapsed['count_lo'].cumsum()
-    collapsed['count_hi'] = 1
-    collapsed['count_hi'] = collapsed.groupby(lo_)['count_hi'].cumsum()
+    collapsed[lo_] = collapsed[lo_].astype('category')
+    collapsed['mean_lo'] = \
+        collapsed.groupby(lo_, observed=True)['mean_hi'].transform('sum')
+    order_ = np.lexsort((-collapsed['mean_hi'].to_numpy(), 
+                         -collapsed['mean_lo'].to_numpy()))
+    collapsed = collapsed.take(order_)
+
+    # Counts the rough groups seen so far and the position of each row within
+    # its rough group. Codes are assigned in order of appearance, so the
+    # running maximum is the number of groups seen; the within group position
+    # comes from a stable sort on the codes.
+    codes_ = pd.factorize(collapsed[lo_])[0]
+    order_ = np.argsort(codes_, kind='stable')
+    sorted_ = codes_[order_]
+    starts_ = np.flatnonzero(np.diff(sorted_, prepend=-1))
+    count_hi = np.empty(codes_.size, dtype=int)
+    count_hi[order_] = np.arange(codes_.size) - starts_[sorted_] + 1
+    collapsed['count_lo'] = np.maximum.accumulate(codes_) + 1.
+    collapsed['count_hi'] = count_hi
 
     collapsed['thresh_lo'] = ((collapsed['mean_lo'] > lo_thresh) & 
                               (collapsed['count_lo'] <= lo_count))
@@ -226,25 +394,26 @@ def profile_joint_levels(collapsed, lo_, hi_, samples, lo_thresh=0.01,
 
     top_lo = collapsed.loc[collapsed['thresh_lo']].copy()
     top_lo['other'] = ~(top_lo['thresh_lo'] & ~top_lo['thresh_hi']) * 1
-    top_lo['new_name'] = top_lo[lo_].apply(lambda x: 'other %s' % x )
+    top_lo['new_name'] = 'other ' + top_lo[lo_].astype(str)
     top_lo.loc[top_lo['thresh_hi'], 'new_name'] = \
         top_lo.loc[top_lo['thresh_hi'], hi_]
 
-    drop_levels = np.arange(hi_)[np.arange(hi_) != lo_]
-    top_lo.drop(columns=drop_levels, inplace=True)
-    new_taxa = top_lo.groupby([lo_, 'new_name']).sum(dropna=True)
-    new_taxa.reset_index(inplace=True)
-    new_taxa['mean_lo'] = new_taxa[lo_].replace(mean_lo_rep)
-    new_taxa.set_index([lo_, 'new_name'], inplace=True)
-    new_taxa.sort_values(['mean_lo', 'count_hi', 'mean_hi'], 
-                         ascending=[False, True, False], 
-                         inplace=True)
-
-    upper_ = new_taxa.cumsum()[samples]
-    upper_.sort_values([upper_.index[0], upper_.index[1]],
-                       axis='columns', 
-                       inplace=True, ascending=False)
-    lower_ = upper_ - new_taxa[upper_.columns]
+    sum_cols = list(samples) + ['mean_hi', 'count_hi']
+    new_taxa = top_lo.groupby([lo_, 'new_name'], observed=True)[sum_cols].sum()
+    # Every row of a retained rough group is kept, so summing the fine means
+    # within the group gives back the rough mean
+    new_taxa['mean_lo'] = \
+        new_taxa.groupby(level=0, observed=True)['mean_hi'].transform('sum')
+    order_ = np.lexsort((-new_taxa['mean_hi'].to_numpy(), 
+                         new_taxa['count_hi'].to_numpy(),
+                         -new_taxa['mean_lo'].to_numpy()))
+    new_taxa = new_taxa.take(order_)
+
+    upper_, lower_ = stack_limits(new_taxa[samples])
+    order_ = np.lexsort((-upper_.iloc[1].to_numpy(), 
+                         -upper_.iloc[0].to_numpy()))
+    upper_ = upper_.iloc[:, order_]
+    lower_ = lower_.iloc[:, order_]
     
     upper_.index.set_names(['rough', 'fine'], inplace=True)
     lower_.index.set_names(['rough', 'fine'], inplace=True)
@@ -259,8 +428,10 @@ def define_single_cmap(cmap, top_taxa):
     """
     # Gets the colormap object
     map_ = mpl.colormaps[cmap]
-    # Gets the taxonomic object
-    return {tax: map_(i) for i, tax in enumerate(top_taxa.index)}
+    # Looks up the colors for all the taxa at once
+    colors_ = map_(np.arange(len(top_taxa.index)))
+
+    return dict(zip(top_taxa.index, colors_))
 
 
 def define_join_cmap(table):
@@ -275,10 +446,10 @@ def define_join_cmap(table):
     rough_map = {group: mpl.colormaps[cmap] 
                  for (group,cmap) in zip(*(rough_order, colors_order))} 
     pooled_map = dict([])
-    for rough_, fine_ in grouping.groupby('rough')['fine']:
+    for rough_, fine_ in grouping.groupby('rough', observed=True)['fine']:
         cmap_ = rough_map[rough_]
-        colors = {c: cmap_(200-(i + 1) * 20) for i, c in enumerate(fine_)}
-        pooled_map.update(colors)
+        colors = cmap_(200 - (np.arange(len(fine_)) + 1) * 20)
+        pooled_map.update(zip(fine_, colors))
 
     table.drop(columns=['dummy'], inplace=True)
 
@@ -318,24 +489,28 @@ def plot_area(upper_, lower_, colors, sample_interval=5):
     fig_.set_size_inches((8, 4))
     ax1.set_position((0.15, 0.125, 0.4, 0.75))
     
-    # Plots the area plot
+    # Plots the area plot. The layers are stacked from the bottom in the
+    # order of the table, so the first taxon sits on the x-axis. Very dense
+    # stacks are rasterized, while the axes and text stay editable.
     x = np.arange(0, len(upper_.columns))
-    for taxa, hi_ in upper_.iloc[::-1].iterrows():
-        lo_ = lower_.loc[taxa]
-        cl_ = colors[taxa]
-
-    
-        ax1.fill_between(x=x, y1=1-lo_.values, y2=1-hi_.values, 
-                         color=cl_, label=taxa)
-    # Adds the legend
-    leg_ = ax1.legend()
+    # A missing value is drawn as an empty layer, so that the taxa stacked
+    # above it are still drawn for that sample
+    heights_ = np.nan_to_num(upper_.to_numpy(dtype=float) - 
+                             lower_.to_numpy(dtype=float))
+    ax1.stackplot(x, heights_, 
+                  colors=[colors[taxa] for taxa in upper_.index],
+                  labels=list(upper_.index),
+                  rasterized=(heights_.size > raster_points))
+
+    # Adds the legend, reversed so the order matches the stack
+    handles_, labels_ = ax1.get_legend_handles_labels()
+    leg_ = ax1.legend(handles_[::-1], labels_[::-1])
     leg_.set_bbox_to_anchor((2.05, 1))
 
-    # Sets up the y-axis so the order matches the colormap
-    # (accomplished by flipping the axis?)
-    ax1.set_ylim((1, 0))
+    # Sets up the y-axis
+    ax1.set_ylim((0, 1))
     ax1.set_yticks(np.arange(0, 1.1, 0.25))
-    ax1.set_yticklabels(np.arange(1, -0.1, -0.25), size=11)
+    ax1.set_yticklabels(np.arange(0, 1.1, 0.25), size=11)
     ax1.set_ylabel('Relative Abundance', size=13)
 
     # Sets up x-axis without numeric labels
@@ -347,10 +522,71 @@ def plot_area(upper_, lower_, colors, sample_interval=5):
     return fig_
 
 
+def collapse_table(table, level, samples=None, tax_col='taxon_name', 
+    tax_delim='|', multilevel_table=True, cache=None):
+    """
+    Parses the taxonomy and collapses the table to the specified level
+
+    Parameters
+    ----------
+    table : DataFrame
+        A pandas or polars dataframe of the original table of data (either 
+        containing counts or relative abundance). A polars dataframe is 
+        collapsed with `level_taxonomy_polars`. This is not used if `cache` 
+        exists.
+    level : int
+        The hierarchical level within the table to collapse to
+    samples : list, optional
+        The columns from `table` to be included in the analysis. If `samples`
+        is None, then all columns in `table` except `tax_col` will be used.
+    tax_col : str, optional
+        The column in `table` which contains the taxonomic information.
+    tax_delim: str, optional
+        The delimiter between taxonomic levels, for example "|" or ";".
+    multilevel_table: bool, optional
+        Whether the table contains multiple concatenated levels. See 
+        `level_taxonomy`.
+    cache: str, optional
+        A parquet file caching the collapsed table. If the file exists, it is
+        read instead of collapsing `table`; otherwise the collapsed table is
+        written to it.
+
+    Returns
+    -------
+    DataFrame
+        The relative abundance of each taxon at `level` in each sample
+    """
+    if (cache is not None) and os.path.exists(cache):
+        collapsed = pd.read_parquet(cache)
+        # The levels are numbered, but are stored with string names
+        collapsed.index.names = [int(n) for n in collapsed.index.names]
+        return collapsed
+
+    if samples is None:
+        samples = [c for c in table.columns if c != tax_col]
+
+    if isinstance(table, pd.DataFrame):
+        taxa = extract_label_array(table, tax_col, tax_delim)
+        collapsed = level_taxonomy(table, taxa, samples, np.array([level]), 
+                                   consider_nan=multilevel_table)
+    else:
+        collapsed = level_taxonomy_polars(table, samples, level, tax_col, 
+                                          tax_delim=tax_delim, 
+                                          consider_nan=multilevel_table)
+
+    if cache is not None:
+        os.makedirs(os.path.dirname(cache) or '.', exist_ok=True)
+        collapsed.rename_axis(index=[str(n) for n in collapsed.index.names],
+                              copy=False
+                              ).to_parquet(cache, compression='zstd')
+
+    return collapsed
+
+
 def single_area_plot(table, level=3, samples=None, 
     tax_col='taxon_name', cmap='Set3',
     tax_delim='|', multilevel_table=True, abund_thresh=0.1, 
-    group_thresh=8):
+    group_thresh=8, cache=None):
     """
     Generates an area plot for the table at the specified level of resolution
 
@@ -387,6 +623,9 @@ def single_area_plot(table, level=3, samples=None,
         to be displayed, a group must have both a mean relative abundance 
         exceeding the `abund-thresh` and must be in the top `group-thresh` 
         groups.
+    cache: str, optional
+        A parquet file caching the collapsed table. If it exists, it is read
+        in place of collapsing `table`, otherwise it is written.
 
     Returns
     -------
@@ -412,15 +651,10 @@ def single_area_plot(table, level=3, samples=None,
         cmap = 'Set3'
 
     # Parses the taxonomy and collapses the table
-    taxa = extract_label_array(table, tax_col, tax_delim)
-
-    if samples is None:
-        samples = list(table.columns.values)
-        samples.remove(tax_col)
-
-    # Gets the appropriate taxonomic level information to go forward
-    collapsed = level_taxonomy(table, taxa, samples, np.array([level]), 
-                              consider_nan=multilevel_table)
+    collapsed = collapse_table(table, level, samples=samples, 
+                               tax_col=tax_col, tax_delim=tax_delim, 
+                               multilevel_table=multilevel_table, 
+                               cache=cache)
 
     # Gets the top taxonomic levels
     upper_, lower_, = profile_one_level(collapsed, np.array([level]), 
@@ -440,7 +674,7 @@ def joint_area_plot(table, rough_level=2, fine_level=5, samples=None,
     tax_col='taxon_name', tax_delim='|', 
     multilevel_table=True, abund_thresh_rough=0.1, 
     abund_thresh_fine=0.05, group_thresh_fine=5, 
-    group_thresh_rough=5):
+    group_thresh_rough=5, cache=None):
     """
     Generates an area plot with nested grouping where the the higher level
     (`rough_level`) in the table (lower resolution/fewer groups) is used to 
@@ -480,6 +714,9 @@ def joint_area_plot(table, rough_level=2, fine_level=5, samples=None,
         The maximum number of taxonmic groups to display for the respective 
         level. If `group_thresh_rough` > 6, then it will be replaced with 
         6 because this is the maximum number of avaliable color groups.
+    cache: str, optional
+        A parquet file caching the collapsed table. If it exists, it is read
+        in place of collapsing `table`, otherwise it is written.
 
     Returns
     -------
@@ -493,14 +730,10 @@ def joint_area_plot(table, rough_level=2, fine_level=5, samples=None,
     """
 
     # Parses the taxonomy and collapses the table
-    taxa = extract_label_array(table, tax_col, tax_delim)
-    if samples is None:
-        samples = list(table.drop(columns=[tax_col]).columns)
-
-    # Gets the appropriate taxonomic level information to go forward
-    collapsed = level_taxonomy(table, taxa, samples, 
-                               level=np.array([fine_level]), 
-                               consider_nan=multilevel_table)
+    collapsed = collapse_table(table, fine_level, samples=samples, 
+                               tax_col=tax_col, tax_delim=tax_delim, 
+                               multilevel_table=multilevel_table, 
+                               cache=cache)
     samples = collapsed.columns
 
     # Gets the top taxonomic levels
@@ -517,11 +750,143 @@ def joint_area_plot(table, rough_level=2, fine_level=5, samples=None,
     lower_.index = lower_.index.droplevel('rough')
 
     # Plots the data
-    fig_ = plot_area(upper_.astype(float), lower_.astype(float), cmap)
+    fig_ = plot_area(upper_, lower_, cmap)
 
     return fig_
 
 
+def read_table(path, skip_rows=0, columns=None, engine='pandas'):
+    """
+    Reads a feature table from a tsv or parquet file
+
+    Parameters
+    ----------
+    path : str
+        The path to the feature table. Files ending in `.parquet` are read
+        as parquet, everything else as a tab-separated table.
+    skip_rows : int, optional
+        The number of rows to skip before the header of a tab-separated 
+        table.
+    columns : list, optional
+        The columns to read. If `columns` is None, all columns are read. 
+        Columns not listed here are never parsed.
+    engine : {'pandas', 'polars'}, optional
+        The library used to read and hold the table
+
+    Returns
+    -------
+    DataFrame
+        The feature table, as a polars DataFrame if `engine` is 'polars'
+    """
+    if engine == 'polars':
+        import polars as pl
+
+        if str(path).endswith('.parquet'):
+            return pl.read_parquet(path, columns=columns)
+        # The whole file is used to infer the column types, since counts can
+        # look like integers for many rows before the first fraction
+        return pl.read_csv(path, separator='\t', skip_rows=skip_rows, 
+                           columns=columns, infer_schema_length=None)
+
+    if str(path).endswith('.parquet'):
+        return pd.read_parquet(path, columns=columns)
+
+    # The header row is given by position, since the pyarrow engine does not
+    # honour `skiprows` together with a header
+    return pd.read_csv(path, sep='\t', header=skip_rows, usecols=columns,
+                       engine='pyarrow')
+
+
+def read_level_table(path, tax_col, level, tax_delim='|', consider_nan=True,
+    skip_rows=0, columns=None, chunksize=100000):
+    """
+    Reads only the rows of a feature table at a single taxonomic level
+
+    The table is streamed in chunks of `chunksize` rows and each chunk is 
+    filtered to the rows at `level` before the next one is read, so the 
+    full table is never held in memory at once.
+
+    Parameters
+    ----------
+    path : str
+        The path to the feature table, either as a tab-separated table or, 
+        for paths ending in `.parquet`, as parquet.
+    tax_col : str
+        The column in the table containing the taxonomy information
+    level : int
+        The taxonomic level to keep
+    tax_delim: str, optional
+        The delimiter between taxonomic levels
+    consider_nan: bool, optional
+        Whether only rows ending at `level` should be kept. See 
+        `level_taxonomy`.
+    skip_rows : int, optional
+        The number of rows to skip before the header of a tab-separated 
+        table.
+    columns : list, optional
+        The columns to read. If `columns` is None, all columns are read. 
+    chunksize : int, optional
+        The number of rows read at a time
+
+    Returns
+    -------
+    DataFrame
+        The rows of the feature table at `level`
+    """
+    if str(path).endswith('.parquet'):
+        batches_ = pq.ParquetFile(path).iter_batches(batch_size=chunksize,
+                                                     columns=columns)
+        chunks_ = (batch_.to_pandas() for batch_ in batches_)
+    else:
+        chunks_ = pd.read_csv(path, sep='\t', header=skip_rows, 
+                              usecols=columns, chunksize=chunksize)
+
+    kept_ = []
+    for chunk_ in chunks_:
+        taxa_ = extract_label_array(chunk_, tax_col, tax_delim)
+        kept_.append(chunk_.loc[level_filter(taxa_, level, consider_nan)])
+
+    return pd.concat(kept_, ignore_index=True)
+
+
+def cache_path(cache_dir, path, level, tax_col, tax_delim, 
+    multilevel_table, skip_rows=0, samples=None, table_drop=None):
+    """
+    Gets the cache file for a table collapsed to a taxonomic level
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory holding the cached tables
+    path : str
+        The path to the original feature table. Its location, size and 
+        modification time identify the table, so changing the table 
+        invalidates the cache.
+    level : int
+        The taxonomic level the table is collapsed to
+    tax_col, tax_delim, multilevel_table, skip_rows, samples
+        The options used to read and collapse the table, as for 
+        `read_table` and `collapse_table`
+    table_drop : list, optional
+        The columns dropped from the table. Without a sample list, these 
+        decide which columns are treated as samples.
+
+    Returns
+    -------
+    str
+        The path to the parquet cache file
+    """
+    stat_ = os.stat(path)
+    if table_drop is not None:
+        table_drop = sorted(table_drop)
+    key_ = repr((os.path.realpath(path), stat_.st_mtime_ns, stat_.st_size, 
+                 tax_col, tax_delim, multilevel_table, skip_rows, samples,
+                 table_drop))
+    digest_ = hashlib.sha1(key_.encode()).hexdigest()
+
+    return os.path.join(cache_dir, '%s_%i.parquet' % (digest_, level))
+
+
 # Sets up the main arguments for argparse.
 def create_argparse():
     parser_one = argparse.ArgumentParser(
@@ -533,7 +898,8 @@ def create_argparse():
         '-t', '--table', 
         help=('The abundance table as a tsv classic biom (features as rows, '
               'samples as columns) containing absloute or relative abundance '
-              'for the samples.'),
+              'for the samples. Files ending in `.parquet` are read as '
+              'parquet.'),
         required=True,
         )
     parser_one.add_argument(
@@ -620,6 +986,28 @@ def create_argparse():
         '--skip-rows',
         help=('The number of rows to skip when reading in the feature table.')
         )
+    parser_one.add_argument(
+        '--engine',
+        choices=['pandas', 'polars'],
+        default='pandas',
+        help=('The library used to read the table and collapse the taxonomy. '
+              'Polars is multithreaded and is typically faster on large '
+              'tables.'),
+        )
+    parser_one.add_argument(
+        '--cache-dir',
+        help=('A directory in which to cache the table collapsed to the '
+              'plotted level. Re-running on an unchanged table with the same '
+              'level and parsing options reads the cached table instead of '
+              'parsing the full table again.'),
+        )
+    parser_one.add_argument(
+        '--chunksize',
+        help=('Read the feature table this many rows at a time, keeping only '
+              'the rows at the plotted level. This limits the memory needed '
+              'for very large tables.'),
+        type=int,
+        )
 
     return parser_one
 
@@ -633,6 +1021,9 @@ if __name__ == '__main__':
 
     args = parser_one.parse_args()
 
+    if (args.engine == 'polars') and (args.chunksize is not None):
+        parser_one.error('--chunksize is only supported by the pandas engine')
+
     if args.table_drop is not None:
         args.table_drop = [s for s in args.table_drop.split(',')]
     else:
@@ -642,20 +1033,67 @@ if __name__ == '__main__':
     mode_defaults.update({k: v for k, v in args.__dict__.items() 
                          if (k in mode_defaults) and (v)})
 
-    table = pd.read_csv(args.table, sep='\t', 
-                        skiprows=mode_defaults['skip_rows'])
     if args.samples is not None:
         with open(args.samples, 'r') as f_:
-            samples = f_.read().split('\n')
+            samples = [s for s in f_.read().split('\n') if s]
+        columns = [mode_defaults['tax_col']] + samples
     else:
         samples = None
+        columns = None
+
+    # The table is collapsed to the fine level for joint plots
+    if args.sub_level is not None:
+        collapse_level = args.sub_level
+    else:
+        collapse_level = args.level
+
+    if args.cache_dir is not None:
+        cache = cache_path(
+            args.cache_dir,
+            args.table,
+            level=collapse_level,
+            tax_col=mode_defaults['tax_col'],
+            tax_delim=mode_defaults['tax_delim'],
+            multilevel_table=mode_defaults['multi_level'],
+            skip_rows=int(mode_defaults['skip_rows']),
+            samples=samples,
+            table_drop=mode_defaults['table_drop'],
+        )
+    else:
+        cache = None
+
+    if (cache is not None) and os.path.exists(cache):
+        # The collapsed table is read from the cache instead
+        table = None
+    elif args.chunksize is not None:
+        table = read_level_table(
+            args.table,
+            tax_col=mode_defaults['tax_col'],
+            level=collapse_level,
+            tax_delim=mode_defaults['tax_delim'],
+            consider_nan=mode_defaults['multi_level'],
+            skip_rows=int(mode_defaults['skip_rows']),
+            columns=columns,
+            chunksize=args.chunksize,
+        )
+    else:
+        table = read_table(args.table, 
+                           skip_rows=int(mode_defaults['skip_rows']),
+                           columns=columns,
+                           engine=args.engine)
+    if table is not None:
+        drop_ = [c for c in mode_defaults['table_drop'] if c in table.columns]
+        if args.engine == 'polars':
+            table = table.drop(drop_)
+        else:
+            table = table.drop(columns=drop_)
 
     if args.sub_level is not None:
         fig_ = joint_area_plot(
-            table.drop(columns=mode_defaults['table_drop']),
+            table,
             rough_level=args.level,
             fine_level=args.sub_level,
-            samples=args.samples,
+            samples=samples,
             tax_delim=mode_defaults['tax_delim'],
             tax_col=mode_defaults['tax_col'],
             multilevel_table=mode_defaults['multi_level'],
@@ -663,10 +1101,11 @@ if __name__ == '__main__':
             group_thresh_rough=args.group_thresh,
             abund_thresh_fine=args.sub_abund_thresh,
             group_thresh_fine=args.sub_group_thresh,
+            cache=cache,
         )
     else:
         fig_ = single_area_plot(
-            table.drop(columns=mode_defaults['table_drop']),
+            table,
             level=args.level,
             cmap=args.colormap,
             samples=samples,
@@ -675,6 +1114,7 @@ if __name__ == '__main__':
             multilevel_table=mode_defaults['multi_level'],
             abund_thresh=args.abund_thresh,
             group_thresh=args.group_thresh,
+            cache=cache,
         )
 
     fig_.savefig(args.output, dpi=300)